@@ -0,0 +1,34 @@
+"""
+Helpers shared by the downloader and the embeddings generator.
+
+Kept free of third-party dependencies (orjson is optional) so importing the
+embeddings module or the scanner doesn't pull in the downloader's HTTP stack.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def write_json(path, data, indent=True):
+    """Write data to path as UTF-8 JSON, using orjson when it is installed."""
+    if orjson is not None:
+        with open(path, 'wb') as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2 if indent else 0))
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2 if indent else None)
+
+def safe_local_name(card, suffix):
+    """
+    Return the local image filename for a card, e.g. 'base1-1_Alakazam_large.png'.
+    
+    This is the single naming rule shared by the downloader and the embeddings
+    generator, so both sides always agree on which file belongs to which card.
+    """
+    card_id = card.get('id', 'unknown')
+    safe_name = "".join(c for c in f"{card_id}_{card.get('name', 'unknown')}" if c.isalnum() or c in (' ', '-', '_')).rstrip()
+    safe_name = safe_name.replace(' ', '_')[:50]  # Limit length
+    return f"{safe_name}_{suffix}.png"
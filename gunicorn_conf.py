@@ -0,0 +1,32 @@
+import os
+
+# Serve the scanner API: gunicorn -c gunicorn_conf.py scanner_app:app
+bind = os.environ.get('SCANNER_BIND', '0.0.0.0:5001')
+
+# Every worker holds its own CLIP + EasyOCR models (on GPU, on the same card), so keep
+# the count small; threads overlap request I/O with the OCR/CLIP work that releases the GIL
+workers = int(os.environ.get('SCANNER_WORKERS', 2))
+worker_class = 'gthread'
+threads = 4
+
+# Model loading takes a while on a cold start
+timeout = 120
+
+# Load the models once in the master so workers share the pages copy-on-write.
+# CUDA can't be initialized before a fork, so on GPU hosts each worker loads its own.
+# This is decided without importing torch here: asking torch would initialize CUDA in
+# the master and break every forked worker. Set SCANNER_PRELOAD=0/1 to override.
+if 'SCANNER_PRELOAD' in os.environ:
+    preload_app = os.environ['SCANNER_PRELOAD'] == '1'
+else:
+    preload_app = not os.path.exists('/dev/nvidiactl')
+
+# The webcam page needs HTTPS; use the same self-signed pair as secure_server.py
+if os.path.exists('cert.pem') and os.path.exists('key.pem'):
+    certfile = 'cert.pem'
+    keyfile = 'key.pem'
+
+def post_fork(server, worker):
+    # Split the cores between workers instead of each torch using all of them
+    import torch
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // workers))
@@ -8,10 +8,11 @@ Creates a searchable vector database for semantic similarity search.
 
 import os
 import json
+import csv
 import numpy as np
-import pandas as pd
 from PIL import Image
 import torch
+from torch.utils.data import Dataset, DataLoader
 import clip
 from tqdm import tqdm
 import pickle
@@ -20,6 +21,25 @@ import logging
 from datetime import datetime
 import argparse
 
+from card_files import safe_local_name, write_json
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from torchvision.io import read_file, decode_image, ImageReadMode
+    from torchvision.transforms import InterpolationMode, v2
+    from torchvision.transforms.functional import pil_to_tensor
+except ImportError:
+    v2 = None
+
 # Setup logging
 logging.basicConfig(
     level=logging.INFO,
@@ -31,6 +51,81 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# CLIP's input normalization constants
+CLIP_MEAN = (0.48145466, 0.4578275, 0.40821073)
+CLIP_STD = (0.26862954, 0.26130258, 0.27577711)
+
+# Embeddings are stored on disk and in the search index as fp16: retrieval quality is
+# unchanged for CLIP cosine similarity, and file size and scan bandwidth are halved
+EMBEDDING_STORAGE_DTYPE = np.float16
+
+# Bump whenever the card lookup's construction changes (naming rule, index join, layout)
+# so caches built by older code are rebuilt even if the source files haven't changed
+CARD_LOOKUP_CACHE_VERSION = 1
+
+class PILImageLoader:
+    """Loads an image with PIL and applies CLIP's own preprocessing."""
+    
+    def __init__(self, preprocess):
+        self.preprocess = preprocess
+        
+    def __call__(self, image_path):
+        return self.from_pil(Image.open(os.fspath(image_path)))
+        
+    def from_pil(self, pil_image):
+        return self.preprocess(pil_image.convert('RGB'))
+
+class TensorImageLoader:
+    """
+    Decodes an image with torchvision.io and resizes/crops it as a uint8 tensor.
+    
+    Scaling and normalization are left to encode_batch, so they run once per batch on
+    the model's device and the host-to-device copy moves uint8 instead of float32.
+    """
+    
+    def __init__(self, n_px):
+        self.transform = v2.Compose([
+            v2.Resize(n_px, interpolation=InterpolationMode.BICUBIC, antialias=True),
+            v2.CenterCrop(n_px)
+        ])
+        
+    def __call__(self, image_path):
+        try:
+            image = decode_image(read_file(os.fspath(image_path)), mode=ImageReadMode.RGB)
+        except RuntimeError:
+            # Formats torchvision can't decode still go through PIL
+            return self.from_pil(Image.open(os.fspath(image_path)))
+        return self.transform(image)
+        
+    def from_pil(self, pil_image):
+        return self.transform(pil_to_tensor(pil_image.convert('RGB')))
+
+class CardImageDataset(Dataset):
+    """Dataset that decodes and preprocesses card images inside DataLoader workers."""
+    
+    def __init__(self, image_files, load_image):
+        # Plain path strings pickle cheaply to workers (os.DirEntry doesn't pickle at all)
+        self.image_files = [os.fspath(p) for p in image_files]
+        self.load_image = load_image
+        
+    def __len__(self):
+        return len(self.image_files)
+    
+    def __getitem__(self, idx):
+        image_path = self.image_files[idx]
+        try:
+            return self.load_image(image_path), idx
+        except Exception as e:
+            logger.error(f"Error processing {image_path}: {e}")
+            return None, idx
+
+def collate_card_images(items):
+    """Stack the successfully loaded tensors and keep their dataset indices aligned."""
+    tensors = [tensor for tensor, _ in items if tensor is not None]
+    indices = [idx for tensor, idx in items if tensor is not None]
+    batch = torch.stack(tensors) if tensors else None
+    return batch, indices, len(items)
+
 class PokemonCLIPProcessor:
     def __init__(self, base_dir="pokemon_cards", model_name="ViT-B/32", device=None):
         """
@@ -60,55 +155,187 @@ class PokemonCLIPProcessor:
         # Load CLIP model
         logger.info(f"Loading CLIP model: {model_name}")
         self.model, self.preprocess = clip.load(model_name, device=self.device)
+        # clip.load keeps fp16 weights on CUDA, so inference runs in half precision there
+        self.model.eval()
         self.model_name = model_name.replace("/", "-")
         
+        # Decode and resize without PIL when torchvision's v2 transforms are available
+        if v2 is not None:
+            self.image_loader = TensorImageLoader(self.model.visual.input_resolution)
+        else:
+            self.image_loader = PILImageLoader(self.preprocess)
+        self.clip_mean = torch.tensor(CLIP_MEAN, device=self.device).view(1, 3, 1, 1)
+        self.clip_std = torch.tensor(CLIP_STD, device=self.device).view(1, 3, 1, 1)
+        
+        # Set by compile_encoder for bulk embedding runs
+        self.compiled_encode_image = None
+        self.compiled_batch_size = None
+        
         # Load card data
         self.load_card_data()
         
     def load_card_data(self):
-        """Load the card metadata from JSON files."""
+        """Load the card metadata from JSON files, reusing the on-disk lookup cache when it is fresh."""
+        cards_file = self.data_dir / "all_cards.json"
+        index_file = self.data_dir / "index.json"
+        cache_file = self.data_dir / "_card_lookup_cache.pkl"
+        
         try:
-            # Load main card data
-            with open(self.data_dir / "all_cards.json", 'r') as f:
-                self.all_cards = json.load(f)
+            source_mtime = (
+                os.path.getmtime(cards_file),
+                os.path.getmtime(index_file) if index_file.exists() else None
+            )
+            
+            if cache_file.exists():
+                try:
+                    with open(cache_file, 'rb') as f:
+                        cache = pickle.load(f)
+                    if (cache.get('version') == CARD_LOOKUP_CACHE_VERSION
+                            and cache.get('source_mtime') == source_mtime):
+                        self.all_cards = cache['all_cards']
+                        self.card_lookup = cache['card_lookup']
+                        self.card_by_id = {card['id']: card for card in self.all_cards}
+                        logger.info(f"Loaded {len(self.all_cards)} cards from lookup cache")
+                        return
+                except Exception as e:
+                    logger.warning(f"Ignoring unreadable card lookup cache: {e}")
+            
+            # Load main card data (orjson parses the multi-MB dump several times faster)
+            with open(cards_file, 'rb') as f:
+                if orjson is not None:
+                    self.all_cards = orjson.loads(f.read())
+                else:
+                    self.all_cards = json.load(f)
             logger.info(f"Loaded {len(self.all_cards)} cards from database")
+            self.card_by_id = {card['id']: card for card in self.all_cards}
             
             # Create lookup dictionary by image filename
-            self.card_lookup = {}
-            for card in self.all_cards:
-                if 'images' in card and 'large' in card['images']:
-                    # Extract filename from URL
-                    large_url = card['images']['large']
-                    filename = large_url.split('/')[-1]
-                    # Create the expected local filename
-                    local_filename = f"{card['set']['id']}-{card['number']}_{card['name'].replace(' ', '_')}_large.png"
-                    self.card_lookup[local_filename] = card
+            if index_file.exists():
+                # The downloader's index.json already maps filename -> card id
+                with open(index_file, 'r', encoding='utf-8') as f:
+                    image_index = json.load(f)
+                self.card_lookup = {
+                    local_filename: self.card_by_id[card_id]
+                    for local_filename, card_id in image_index.items()
+                    if card_id in self.card_by_id
+                }
+            else:
+                # Older downloads have no index; derive names with the downloader's rule
+                self.card_lookup = {
+                    safe_local_name(card, size): card
+                    for card in self.all_cards
+                    for size in ('large', 'small')
+                    if size in card.get('images', {})
+                }
+            
+            # Cache both structures together; pickle keeps the lookup values as
+            # references into all_cards, so the cache is no bigger than the cards.
+            # Written to a temp file and renamed so concurrent loaders never see a
+            # partial cache; failing to write it (e.g. read-only data dir) isn't fatal.
+            try:
+                tmp_file = cache_file.with_suffix(f'.{os.getpid()}.tmp')
+                with open(tmp_file, 'wb') as f:
+                    pickle.dump({
+                        'version': CARD_LOOKUP_CACHE_VERSION,
+                        'source_mtime': source_mtime,
+                        'all_cards': self.all_cards,
+                        'card_lookup': self.card_lookup
+                    }, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_file, cache_file)
+            except OSError as e:
+                logger.warning(f"Could not write card lookup cache {cache_file}: {e}")
                     
         except FileNotFoundError:
             logger.error("Card data not found. Make sure you've run the download script first.")
             raise
             
     def get_image_files(self, image_type="large"):
-        """Get list of image files to process."""
-        pattern = f"*_{image_type}.png"
-        image_files = list(self.images_dir.glob(pattern))
+        """
+        Get list of image files to process, sorted by name.
+        
+        Returns os.DirEntry objects from a single os.scandir pass; use .name and .path
+        (or os.fspath) downstream.
+        """
+        suffix = f"_{image_type}.png"
+        with os.scandir(self.images_dir) as entries:
+            image_files = sorted((entry for entry in entries if entry.name.endswith(suffix)),
+                                 key=lambda entry: entry.name)
         logger.info(f"Found {len(image_files)} {image_type} images to process")
-        return sorted(image_files)
+        return image_files
+    
+    def preprocess_image(self, image_path):
+        """Load an image from disk and return its preprocessed CLIP input tensor (on CPU)."""
+        return self.image_loader(image_path)
+    
+    def compile_encoder(self, batch_size):
+        """
+        Compile the CLIP image encoder with torch.compile for a fixed batch size (CUDA only).
+        
+        The compiled encoder is only used for batches of exactly batch_size, so other
+        shapes (the final partial batch, single query images) never trigger a recompile.
+        """
+        if self.device != "cuda" or not hasattr(torch, "compile"):
+            return
+        
+        logger.info(f"Compiling CLIP image encoder for batch size {batch_size}...")
+        try:
+            compiled = torch.compile(self.model.encode_image, mode='reduce-overhead', fullgraph=True)
+            # Warm up eagerly so the compile cost isn't paid inside the first real batch
+            n_px = self.model.visual.input_resolution
+            dummy = torch.zeros((batch_size, 3, n_px, n_px), device=self.device)
+            with torch.inference_mode(), torch.autocast('cuda', dtype=torch.float16):
+                compiled(dummy)
+        except Exception as e:
+            logger.warning(f"torch.compile failed, using the eager encoder: {e}")
+            return
+        
+        self.compiled_encode_image = compiled
+        self.compiled_batch_size = batch_size
+    
+    def encode_features(self, batch):
+        """
+        Run a batch of preprocessed images through CLIP and return L2-normalized float32
+        features, still on the model's device.
+        
+        Args:
+            batch (torch.Tensor or list): Stacked (B, 3, H, W) tensor or list of preprocessed tensors
+        """
+        if isinstance(batch, (list, tuple)):
+            batch = torch.stack(batch)
+        batch = batch.to(self.device, non_blocking=True)
+        if batch.dtype == torch.uint8:
+            # Finish TensorImageLoader's preprocessing on the device in one pass over the batch
+            batch = batch.float().div_(255).sub_(self.clip_mean).div_(self.clip_std)
+        use_autocast = self.device == "cuda"
+        
+        with torch.inference_mode(), torch.autocast('cuda', dtype=torch.float16, enabled=use_autocast):
+            if batch.shape[0] == self.compiled_batch_size:
+                image_features = self.compiled_encode_image(batch)
+            else:
+                image_features = self.model.encode_image(batch)
+            # Normalize in fp32 so the half-precision norm doesn't lose accuracy
+            image_features = image_features.float()
+            image_features /= image_features.norm(dim=-1, keepdim=True)
+            
+        return image_features
+    
+    def encode_batch(self, batch):
+        """
+        Encode a batch of preprocessed images in a single CLIP forward pass.
+        
+        Args:
+            batch (torch.Tensor or list): Stacked (B, 3, H, W) tensor or list of preprocessed tensors
+            
+        Returns:
+            np.ndarray: L2-normalized embeddings, one row per input image
+        """
+        return self.encode_features(batch).cpu().numpy()
     
     def process_image(self, image_path):
         """Process a single image and return its CLIP embedding."""
         try:
-            # Load and preprocess image
-            image = Image.open(image_path).convert('RGB')
-            image_tensor = self.preprocess(image).unsqueeze(0).to(self.device)
-            
-            # Generate embedding
-            with torch.no_grad():
-                image_features = self.model.encode_image(image_tensor)
-                # Normalize the features
-                image_features = image_features / image_features.norm(dim=-1, keepdim=True)
-                
-            return image_features.cpu().numpy().flatten()
+            image_tensor = self.preprocess_image(image_path)
+            return self.encode_batch([image_tensor])[0]
             
         except Exception as e:
             logger.error(f"Error processing {image_path}: {e}")
@@ -121,13 +348,53 @@ class PokemonCLIPProcessor:
         """
         return self.process_image(image_path)
     
-    def generate_embeddings(self, image_type="large", batch_size=32):
+    def get_single_image_embedding_from_pil(self, pil_image):
+        """
+        Get the embedding for an in-memory PIL image, e.g. an uploaded photo.
+        Same as get_single_image_embedding but without writing the image to disk first;
+        it goes through the same image loader as the indexed cards so queries and rows
+        are preprocessed identically.
+        """
+        try:
+            image_tensor = self.image_loader.from_pil(pil_image)
+            return self.encode_batch([image_tensor])[0]
+            
+        except Exception as e:
+            logger.error(f"Error processing in-memory image: {e}")
+            return None
+    
+    def _build_metadata_entry(self, image_path):
+        """Build the metadata record stored alongside an image's embedding."""
+        # Get card metadata
+        card_data = self.card_lookup.get(image_path.name, {})
+        
+        return {
+            'filename': image_path.name,
+            'filepath': str(image_path),
+            'card_id': card_data.get('id', ''),
+            'name': card_data.get('name', ''),
+            'set_name': card_data.get('set', {}).get('name', ''),
+            'set_id': card_data.get('set', {}).get('id', ''),
+            'number': card_data.get('number', ''),
+            'types': card_data.get('types', []),
+            'subtypes': card_data.get('subtypes', []),
+            'supertype': card_data.get('supertype', ''),
+            'hp': card_data.get('hp', ''),
+            'rarity': card_data.get('rarity', ''),
+            'artist': card_data.get('artist', ''),
+            'embedding_model': self.model_name,
+            'processed_at': datetime.now().isoformat()
+        }
+    
+    def generate_embeddings(self, image_type="large", batch_size=32, checkpoint_every=10, num_workers=None):
         """
         Generate CLIP embeddings for all images.
         
         Args:
             image_type (str): Type of images to process ('large' or 'small')
-            batch_size (int): Number of images to process before saving checkpoint
+            batch_size (int): Number of images encoded per CLIP forward pass
+            checkpoint_every (int): Number of batches to process between checkpoints
+            num_workers (int): DataLoader worker processes for image decoding (None for all CPUs)
         """
         image_files = self.get_image_files(image_type)
         
@@ -136,107 +403,166 @@ class PokemonCLIPProcessor:
             return
         
         # Output files
-        embeddings_file = self.embeddings_dir / f"embeddings_{image_type}_{self.model_name}.pkl"
+        embeddings_file = self.embeddings_dir / f"embeddings_{image_type}_{self.model_name}.npy"
+        embeddings_info_file = self.embeddings_dir / f"embeddings_{image_type}_{self.model_name}_info.json"
         metadata_file = self.embeddings_dir / f"metadata_{image_type}_{self.model_name}.json"
-        checkpoint_file = self.embeddings_dir / f"checkpoint_{image_type}_{self.model_name}.pkl"
+        checkpoint_file = self.embeddings_dir / f"checkpoint_{image_type}_{self.model_name}.json"
+        partial_file = self.embeddings_dir / f"embeddings_{image_type}_{self.model_name}.partial.npy"
+        embedding_dim = self.model.visual.output_dim
         
         # Load existing progress if available
-        embeddings = []
-        metadata = []
-        processed_files = set()
-        start_idx = 0
+        processed_names = []
+        processed_count = 0
         
-        if checkpoint_file.exists():
+        if checkpoint_file.exists() and partial_file.exists():
             logger.info("Loading checkpoint...")
-            with open(checkpoint_file, 'rb') as f:
-                checkpoint = pickle.load(f)
-                embeddings = checkpoint['embeddings']
-                metadata = checkpoint['metadata']
-                processed_files = checkpoint['processed_files']
-                start_idx = len(embeddings)
-            logger.info(f"Resuming from {start_idx}/{len(image_files)} images")
+            with open(checkpoint_file, 'r', encoding='utf-8') as f:
+                checkpoint = json.load(f)
+            processed_names = checkpoint['processed_files']
+            processed_count = checkpoint['processed_count']
+            emb_memmap = np.lib.format.open_memmap(partial_file, mode='r+')
+            logger.info(f"Resuming from {processed_count}/{len(image_files)} images")
+        else:
+            # Rows are written in place as batches complete, so a checkpoint only needs the row count
+            emb_memmap = np.lib.format.open_memmap(
+                partial_file, mode='w+', dtype=np.float32, shape=(len(image_files), embedding_dim)
+            )
+        
+        # Filter out already-processed files once, before any worker opens them
+        processed_files = set(processed_names)
+        image_files = [p for p in image_files if p.name not in processed_files]
         
         # Process images
-        logger.info(f"Processing {len(image_files) - start_idx} remaining images...")
+        logger.info(f"Processing {len(image_files)} remaining images...")
         
-        for i, image_path in enumerate(tqdm(image_files[start_idx:], 
-                                          desc=f"Generating {image_type} embeddings",
-                                          initial=start_idx, 
-                                          total=len(image_files))):
-            
-            if image_path.name in processed_files:
-                continue
-                
-            # Generate embedding
-            embedding = self.process_image(image_path)
+        def save_checkpoint():
+            emb_memmap.flush()
+            checkpoint = {
+                'processed_count': processed_count,
+                'processed_files': processed_names
+            }
+            write_json(checkpoint_file, checkpoint, indent=False)
+            logger.info(f"Checkpoint saved at {processed_count} images")
+        
+        # New images may have appeared since the checkpoint was written
+        if processed_count + len(image_files) > emb_memmap.shape[0]:
+            grown_file = partial_file.with_suffix('.grow.npy')
+            grown = np.lib.format.open_memmap(
+                grown_file, mode='w+', dtype=np.float32,
+                shape=(processed_count + len(image_files), embedding_dim)
+            )
+            grown[:processed_count] = emb_memmap[:processed_count]
+            grown.flush()
+            del emb_memmap, grown
+            grown_file.replace(partial_file)
+            emb_memmap = np.lib.format.open_memmap(partial_file, mode='r+')
+        
+        if num_workers is None:
+            num_workers = os.cpu_count() or 0
+        use_cuda = self.device == "cuda"
+        loader_kwargs = {}
+        if num_workers > 0:
+            loader_kwargs = {'prefetch_factor': 4, 'persistent_workers': True}
+        
+        loader = DataLoader(
+            CardImageDataset(image_files, self.image_loader),
+            batch_size=batch_size,
+            num_workers=num_workers,
+            pin_memory=use_cuda,
+            collate_fn=collate_card_images,
+            **loader_kwargs
+        )
+        
+        # Compiling only pays off if at least one full batch of the compiled size arrives
+        if len(image_files) >= batch_size:
+            self.compile_encoder(batch_size)
+        
+        # On CUDA, results come back through two pinned host buffers used alternately:
+        # batch N's device-to-host copy is issued asynchronously and only waited on after
+        # batch N+1's forward pass has been launched, so the copy overlaps GPU compute.
+        if use_cuda:
+            host_buffers = [
+                torch.empty((batch_size, embedding_dim), dtype=torch.float32, pin_memory=True)
+                for _ in range(2)
+            ]
+        
+        def write_rows(rows, copy_done, indices):
+            nonlocal processed_count
+            if copy_done is not None:
+                copy_done.synchronize()
+            emb_memmap[processed_count:processed_count + len(indices)] = rows.numpy()
+            processed_count += len(indices)
             
-            if embedding is not None:
-                embeddings.append(embedding)
+            # indices map each row of the batch back to its image path
+            for idx in indices:
+                processed_names.append(image_files[idx].name)
+        
+        pending = None
+        
+        with tqdm(desc=f"Generating {image_type} embeddings",
+                  total=len(image_files)) as progress:
+            for batch_num, (batch, indices, num_items) in enumerate(loader, 1):
+                current = None
+                if batch is not None:
+                    features = self.encode_features(batch)
+                    if use_cuda:
+                        host_rows = host_buffers[batch_num % 2][:len(indices)]
+                        host_rows.copy_(features, non_blocking=True)
+                        copy_done = torch.cuda.Event()
+                        copy_done.record()
+                        current = (host_rows, copy_done, indices)
+                    else:
+                        current = (features, None, indices)
                 
-                # Get card metadata
-                card_data = self.card_lookup.get(image_path.name, {})
+                # Write the previous batch now that this one is already queued on the GPU
+                if pending is not None:
+                    write_rows(*pending)
+                pending = current
                 
-                # Create metadata entry
-                meta_entry = {
-                    'filename': image_path.name,
-                    'filepath': str(image_path),
-                    'card_id': card_data.get('id', ''),
-                    'name': card_data.get('name', ''),
-                    'set_name': card_data.get('set', {}).get('name', ''),
-                    'set_id': card_data.get('set', {}).get('id', ''),
-                    'number': card_data.get('number', ''),
-                    'types': card_data.get('types', []),
-                    'subtypes': card_data.get('subtypes', []),
-                    'supertype': card_data.get('supertype', ''),
-                    'hp': card_data.get('hp', ''),
-                    'rarity': card_data.get('rarity', ''),
-                    'artist': card_data.get('artist', ''),
-                    'embedding_model': self.model_name,
-                    'processed_at': datetime.now().isoformat()
-                }
-                metadata.append(meta_entry)
-                processed_files.add(image_path.name)
+                progress.update(num_items)
                 
-            # Save checkpoint every batch_size images
-            if (i + 1) % batch_size == 0:
-                checkpoint = {
-                    'embeddings': embeddings,
-                    'metadata': metadata,
-                    'processed_files': processed_files
-                }
-                with open(checkpoint_file, 'wb') as f:
-                    pickle.dump(checkpoint, f)
-                logger.info(f"Checkpoint saved at {start_idx + i + 1}/{len(image_files)} images")
+                # Save checkpoint every checkpoint_every batches
+                if batch_num % checkpoint_every == 0:
+                    save_checkpoint()
+            
+            if pending is not None:
+                write_rows(*pending)
         
-        # Convert embeddings to numpy array
-        if embeddings:
-            embeddings_array = np.array(embeddings)
+        if processed_count:
+            embeddings_array = emb_memmap[:processed_count].astype(EMBEDDING_STORAGE_DTYPE)
             logger.info(f"Generated embeddings shape: {embeddings_array.shape}")
             
-            # Save final embeddings
-            with open(embeddings_file, 'wb') as f:
-                pickle.dump({
-                    'embeddings': embeddings_array,
-                    'model_name': self.model_name,
-                    'embedding_dim': embeddings_array.shape[1],
-                    'num_images': len(embeddings_array),
-                    'created_at': datetime.now().isoformat()
-                }, f)
+            # Save final embeddings as a contiguous .npy with a small JSON sidecar
+            np.save(embeddings_file, embeddings_array)
+            write_json(embeddings_info_file, {
+                'model_name': self.model_name,
+                'embedding_dim': embeddings_array.shape[1],
+                'num_images': len(embeddings_array),
+                'dtype': np.dtype(EMBEDDING_STORAGE_DTYPE).name,
+                'created_at': datetime.now().isoformat()
+            })
+            
+            # Build metadata in the same row order as the embeddings
+            metadata = [self._build_metadata_entry(self.images_dir / name) for name in processed_names]
             
             # Save metadata
-            with open(metadata_file, 'w') as f:
-                json.dump(metadata, f, indent=2)
+            write_json(metadata_file, metadata, indent=False)
             
             # Create CSV export
-            df = pd.DataFrame(metadata)
             csv_file = self.embeddings_dir / f"metadata_{image_type}_{self.model_name}.csv"
-            df.to_csv(csv_file, index=False)
+            with open(csv_file, 'w', newline='', encoding='utf-8') as csvfile:
+                writer = csv.DictWriter(csvfile, fieldnames=list(metadata[0].keys()))
+                writer.writeheader()
+                writer.writerows(metadata)
             
             # Clean up checkpoint
+            del embeddings_array, emb_memmap
             if checkpoint_file.exists():
                 checkpoint_file.unlink()
+            if partial_file.exists():
+                partial_file.unlink()
             
-            logger.info(f"✅ Successfully generated {len(embeddings)} embeddings!")
+            logger.info(f"✅ Successfully generated {processed_count} embeddings!")
             logger.info(f"📁 Files saved:")
             logger.info(f"   - Embeddings: {embeddings_file}")
             logger.info(f"   - Metadata: {metadata_file}")
@@ -247,39 +573,101 @@ class PokemonCLIPProcessor:
     
     def create_search_index(self, image_type="large"):
         """Create a searchable index from the embeddings."""
-        embeddings_file = self.embeddings_dir / f"embeddings_{image_type}_{self.model_name}.pkl"
+        embeddings_file = self.embeddings_dir / f"embeddings_{image_type}_{self.model_name}.npy"
         metadata_file = self.embeddings_dir / f"metadata_{image_type}_{self.model_name}.json"
         
+        if not embeddings_file.exists():
+            self._convert_legacy_embeddings(image_type)
+        
         if not embeddings_file.exists() or not metadata_file.exists():
             logger.error("Embeddings or metadata files not found. Run generate_embeddings first.")
             return
         
-        # Load data
-        with open(embeddings_file, 'rb') as f:
-            embedding_data = pickle.load(f)
+        # Load data and normalize in float32; the index stores one contiguous
+        # pre-normalized block, so a query is a single matrix-vector product
+        embeddings = np.load(embeddings_file).astype(np.float32)
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings = np.ascontiguousarray(embeddings)
         
-        with open(metadata_file, 'r') as f:
+        with open(metadata_file, 'r', encoding='utf-8') as f:
             metadata = json.load(f)
         
-        embeddings = embedding_data['embeddings']
+        # Save search index: a contiguous float16 .npy that readers memory-map
+        # (the OS page cache shares it across processes) plus one JSON line of
+        # metadata per row
+        index_file = self.embeddings_dir / f"search_index_{image_type}_{self.model_name}.npy"
+        np.save(index_file, np.ascontiguousarray(embeddings, dtype=EMBEDDING_STORAGE_DTYPE))
+        with open(index_file.with_suffix('.jsonl'), 'wb') as f:
+            for meta in metadata:
+                f.write(orjson.dumps(meta) if orjson is not None else json.dumps(meta).encode('utf-8'))
+                f.write(b"\n")
         
-        # Create search index
-        search_index = {
+        # Drop the pickle the previous index format used
+        legacy_file = index_file.with_suffix('.pkl')
+        if legacy_file.exists():
+            legacy_file.unlink()
+        
+        logger.info(f"✅ Search index created: {index_file}")
+        
+        # Build an HNSW graph for sub-linear queries when FAISS is installed
+        faiss_file = index_file.with_suffix('.faiss')
+        if faiss is not None:
+            hnsw_index = faiss.IndexHNSWFlat(embeddings.shape[1], 32, faiss.METRIC_INNER_PRODUCT)
+            hnsw_index.hnsw.efConstruction = 200
+            hnsw_index.add(embeddings)
+            faiss.write_index(hnsw_index, str(faiss_file))
+            logger.info(f"✅ FAISS HNSW index created: {faiss_file}")
+        elif faiss_file.exists():
+            # Don't leave a stale graph behind that no longer matches the metadata
+            faiss_file.unlink()
+        
+        return self.load_search_index(image_type)
+    
+    def _convert_legacy_embeddings(self, image_type):
+        """
+        One-time upgrade of an embeddings pickle written by older versions of this script
+        to the .npy + _info.json layout, so existing installs don't have to re-embed.
+        """
+        legacy_file = self.embeddings_dir / f"embeddings_{image_type}_{self.model_name}.pkl"
+        if not legacy_file.exists():
+            return
+        
+        logger.info(f"Converting legacy embeddings pickle: {legacy_file}")
+        with open(legacy_file, 'rb') as f:
+            embedding_data = pickle.load(f)
+        embeddings_array = np.asarray(embedding_data['embeddings'], dtype=EMBEDDING_STORAGE_DTYPE)
+        
+        np.save(self.embeddings_dir / f"embeddings_{image_type}_{self.model_name}.npy", embeddings_array)
+        write_json(self.embeddings_dir / f"embeddings_{image_type}_{self.model_name}_info.json", {
+            'model_name': self.model_name,
+            'embedding_dim': embeddings_array.shape[1],
+            'num_images': len(embeddings_array),
+            'dtype': np.dtype(EMBEDDING_STORAGE_DTYPE).name,
+            'created_at': embedding_data.get('created_at', datetime.now().isoformat())
+        })
+        legacy_file.unlink()
+    
+    def load_search_index(self, image_type="large"):
+        """Load the search index, memory-mapping the embeddings read-only."""
+        index_file = self.embeddings_dir / f"search_index_{image_type}_{self.model_name}.npy"
+        metadata_file = index_file.with_suffix('.jsonl')
+        
+        if not index_file.exists() or not metadata_file.exists():
+            return None
+        
+        embeddings = np.load(index_file, mmap_mode='r')
+        loads = orjson.loads if orjson is not None else json.loads
+        with open(metadata_file, 'rb') as f:
+            metadata = [loads(line) for line in f if line.strip()]
+        
+        return {
             'embeddings': embeddings,
             'metadata': metadata,
             'model_name': self.model_name,
             'embedding_dim': embeddings.shape[1],
             'num_cards': len(embeddings),
-            'created_at': datetime.now().isoformat()
+            'index_file': index_file
         }
-        
-        # Save search index
-        index_file = self.embeddings_dir / f"search_index_{image_type}_{self.model_name}.pkl"
-        with open(index_file, 'wb') as f:
-            pickle.dump(search_index, f)
-        
-        logger.info(f"✅ Search index created: {index_file}")
-        return search_index
     
     def search_similar_cards(self, query_image_path, top_k=10, image_type="large"):
         """
@@ -290,33 +678,50 @@ class PokemonCLIPProcessor:
             top_k (int): Number of similar cards to return
             image_type (str): Type of embeddings to use
         """
-        index_file = self.embeddings_dir / f"search_index_{image_type}_{self.model_name}.pkl"
+        search_index = self.load_search_index(image_type)
         
-        if not index_file.exists():
+        if search_index is None:
             logger.error("Search index not found. Run create_search_index first.")
             return None
         
-        # Load search index
-        with open(index_file, 'rb') as f:
-            search_index = pickle.load(f)
-        
         # Process query image
         query_embedding = self.process_image(query_image_path)
         if query_embedding is None:
             logger.error(f"Could not process query image: {query_image_path}")
             return None
         
-        # Calculate similarities
-        embeddings = search_index['embeddings']
-        similarities = np.dot(embeddings, query_embedding)
+        query_embedding = query_embedding.astype(np.float32)
         
-        # Get top-k results
-        top_indices = np.argsort(similarities)[::-1][:top_k]
+        # Use the FAISS HNSW index when available; fall back to the exact scan otherwise
+        faiss_file = search_index['index_file'].with_suffix('.faiss')
+        hnsw_index = None
+        if faiss is not None and faiss_file.exists():
+            hnsw_index = faiss.read_index(str(faiss_file))
+            if hnsw_index.ntotal != len(search_index['metadata']):
+                logger.warning("FAISS index is out of date with the search index, using exact search.")
+                hnsw_index = None
+        
+        if hnsw_index is not None:
+            scores, indices = hnsw_index.search(query_embedding[None, :], top_k)
+            top = [(idx, score) for idx, score in zip(indices[0], scores[0]) if idx >= 0]
+        else:
+            # Calculate similarities (upcast so the product runs as a float32 BLAS call)
+            embeddings = search_index['embeddings'].astype(np.float32)
+            similarities = embeddings @ query_embedding
+            
+            # Get top-k results: partition in O(N), then sort only the k winners
+            top_k = min(top_k, len(similarities))
+            if top_k < len(similarities):
+                top_indices = np.argpartition(-similarities, top_k)[:top_k]
+            else:
+                top_indices = np.arange(len(similarities))
+            top_indices = top_indices[np.argsort(-similarities[top_indices])]
+            top = [(idx, similarities[idx]) for idx in top_indices]
         
         results = []
-        for idx in top_indices:
+        for idx, similarity in top:
             result = {
-                'similarity': float(similarities[idx]),
+                'similarity': float(similarity),
                 'metadata': search_index['metadata'][idx]
             }
             results.append(result)
@@ -330,9 +735,13 @@ def main():
                        help='CLIP model to use')
     parser.add_argument('--image-type', default='large', choices=['large', 'small'], 
                        help='Image type to process')
-    parser.add_argument('--batch-size', type=int, default=32, help='Batch size for checkpointing')
+    parser.add_argument('--batch-size', type=int, default=32, help='Number of images per CLIP forward pass')
+    parser.add_argument('--checkpoint-every', type=int, default=10, help='Number of batches between checkpoints')
+    parser.add_argument('--num-workers', type=int, help='DataLoader workers for image decoding (default: all CPUs)')
     parser.add_argument('--device', choices=['cuda', 'cpu'], help='Device to use')
     parser.add_argument('--skip-embeddings', action='store_true', help='Skip embedding generation')
+    parser.add_argument('--rebuild-index', action='store_true',
+                       help='Rebuild the search index from existing embeddings (also upgrades older .pkl embeddings)')
     parser.add_argument('--search', help='Path to query image for similarity search')
     parser.add_argument('--top-k', type=int, default=10, help='Number of similar cards to return')
     
@@ -350,9 +759,12 @@ def main():
         logger.info("🚀 Starting embedding generation...")
         processor.generate_embeddings(
             image_type=args.image_type,
-            batch_size=args.batch_size
+            batch_size=args.batch_size,
+            checkpoint_every=args.checkpoint_every,
+            num_workers=args.num_workers
         )
-        
+    
+    if not args.skip_embeddings or args.rebuild_index:
         # Create search index
         logger.info("📚 Creating search index...")
         processor.create_search_index(image_type=args.image_type)
@@ -380,7 +792,7 @@ if __name__ == "__main__":
         import torch
     except ImportError as e:
         print("❌ Missing required packages. Install with:")
-        print("pip install torch torchvision clip-by-openai pillow tqdm pandas numpy")
+        print("pip install torch torchvision clip-by-openai pillow tqdm numpy")
         exit(1)
     
     main()
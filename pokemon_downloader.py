@@ -5,17 +5,29 @@ Downloads all Pokemon cards from the Pokemon TCG API and saves card data + image
 """
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 import os
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
 from pathlib import Path
 import csv
 from datetime import datetime
 import argparse
+import asyncio
+
+from card_files import safe_local_name, write_json
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
 
 class PokemonCardDownloader:
-    def __init__(self, output_dir="pokemon_cards"):
+    def __init__(self, output_dir="pokemon_cards", max_workers=16, max_concurrent_requests=32):
         self.base_url = "https://api.pokemontcg.io/v2"
         self.output_dir = Path(output_dir)
         self.images_dir = self.output_dir / "images"
@@ -26,6 +38,21 @@ class PokemonCardDownloader:
         self.images_dir.mkdir(exist_ok=True)
         self.data_dir.mkdir(exist_ok=True)
         
+        # Shared HTTP session so downloads reuse pooled keep-alive connections
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=max_concurrent_requests,
+            pool_maxsize=max_concurrent_requests,
+            max_retries=Retry(total=3, backoff_factor=0.5)
+        )
+        self.session.mount("https://", adapter)
+        
+        # Concurrency: worker threads per page, capped number of in-flight requests
+        self.max_workers = max_workers
+        self.max_concurrent_requests = max_concurrent_requests
+        self.request_slots = threading.Semaphore(max_concurrent_requests)
+        self.stats_lock = threading.Lock()
+        
         # Stats
         self.total_cards = 0
         self.downloaded_cards = 0
@@ -40,7 +67,7 @@ class PokemonCardDownloader:
         print("📋 Fetching all Pokemon card sets...")
         
         try:
-            response = requests.get(f"{self.base_url}/sets", timeout=30)
+            response = self.session.get(f"{self.base_url}/sets", timeout=30)
             response.raise_for_status()
             sets_data = response.json()
             
@@ -48,8 +75,7 @@ class PokemonCardDownloader:
             print(f"✅ Found {len(sets)} sets")
             
             # Save sets data
-            with open(self.data_dir / "sets.json", 'w') as f:
-                json.dump(sets_data, f, indent=2)
+            write_json(self.data_dir / "sets.json", sets_data)
             
             return sets
             
@@ -66,7 +92,7 @@ class PokemonCardDownloader:
                 'pageSize': page_size
             }
             
-            response = requests.get(f"{self.base_url}/cards", params=params, timeout=30)
+            response = self.session.get(f"{self.base_url}/cards", params=params, timeout=30)
             response.raise_for_status()
             return response.json()
             
@@ -77,12 +103,13 @@ class PokemonCardDownloader:
     def download_image(self, url, filename):
         """Download a single image"""
         try:
-            response = requests.get(url, stream=True, timeout=30)
-            response.raise_for_status()
-            
-            with open(filename, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
+            with self.request_slots:
+                response = self.session.get(url, stream=True, timeout=30)
+                response.raise_for_status()
+                
+                with open(filename, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=8192):
+                        f.write(chunk)
             
             return True
             
@@ -90,56 +117,103 @@ class PokemonCardDownloader:
             print(f"❌ Failed to download {url}: {e}")
             return False
     
-    def process_card(self, card):
-        """Process a single card - download image and save data"""
+    async def _fetch(self, session, semaphore, url, filename, retries=3, backoff_factor=0.5):
+        """Download a single image on the event loop, retrying transient failures like the requests session does"""
+        for attempt in range(retries + 1):
+            async with semaphore:
+                try:
+                    async with session.get(url) as response:
+                        response.raise_for_status()
+                        with open(filename, 'wb') as f:
+                            async for chunk in response.content.iter_chunked(8192):
+                                f.write(chunk)
+                    return True
+                    
+                except Exception as e:
+                    # Don't leave a truncated file that a later run would treat as downloaded
+                    if filename.exists():
+                        filename.unlink()
+                    transient = isinstance(e, (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError)) or (
+                        isinstance(e, aiohttp.ClientResponseError) and (e.status == 429 or e.status >= 500)
+                    )
+                    if not transient or attempt == retries:
+                        print(f"❌ Failed to download {url}: {e}")
+                        return False
+            
+            # Back off outside the semaphore so other downloads keep the slot busy
+            await asyncio.sleep(backoff_factor * 2 ** attempt)
+    
+    async def _download_page(self, cards):
+        """Download every missing image for a page of cards concurrently"""
+        semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+        connector = aiohttp.TCPConnector(limit=self.max_concurrent_requests * 2)
+        timeout = aiohttp.ClientTimeout(total=30)
+        
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            tasks = []
+            for card in cards:
+                for size in ('large', 'small'):
+                    url = card.get('images', {}).get(size)
+                    image_filename = self.images_dir / safe_local_name(card, size)
+                    if url and not image_filename.exists():
+                        tasks.append(self._fetch(session, semaphore, url, image_filename))
+            await asyncio.gather(*tasks)
+    
+    def process_card(self, card, prefetched=False):
+        """
+        Process a single card - download image and save data
+        
+        If prefetched is True the page's images were already fetched by _download_page,
+        so a missing file is recorded as a failed download instead of being retried.
+        """
         card_id = card.get('id', 'unknown')
         
         try:
-            # Create safe filename
-            safe_name = "".join(c for c in f"{card_id}_{card.get('name', 'unknown')}" if c.isalnum() or c in (' ', '-', '_')).rstrip()
-            safe_name = safe_name.replace(' ', '_')[:50]  # Limit length
-            
             # Download large image if available
             large_image_url = card.get('images', {}).get('large')
             if large_image_url:
-                image_filename = self.images_dir / f"{safe_name}_large.png"
+                image_filename = self.images_dir / safe_local_name(card, 'large')
                 if not image_filename.exists():  # Skip if already downloaded
-                    if self.download_image(large_image_url, image_filename):
+                    if not prefetched and self.download_image(large_image_url, image_filename):
                         card['local_image_large'] = str(image_filename)
                     else:
-                        self.failed_downloads += 1
-                        self.failed_cards.append({
-                            'card_id': card_id,
-                            'error': 'Failed to download large image',
-                            'url': large_image_url
-                        })
+                        with self.stats_lock:
+                            self.failed_downloads += 1
+                            self.failed_cards.append({
+                                'card_id': card_id,
+                                'error': 'Failed to download large image',
+                                'url': large_image_url
+                            })
                 else:
                     card['local_image_large'] = str(image_filename)
             
             # Download small image if available
             small_image_url = card.get('images', {}).get('small')
             if small_image_url:
-                image_filename = self.images_dir / f"{safe_name}_small.png"
+                image_filename = self.images_dir / safe_local_name(card, 'small')
                 if not image_filename.exists():
-                    if self.download_image(small_image_url, image_filename):
+                    if not prefetched and self.download_image(small_image_url, image_filename):
                         card['local_image_small'] = str(image_filename)
                     else:
-                        self.failed_downloads += 1
-            
-            self.downloaded_cards += 1
+                        with self.stats_lock:
+                            self.failed_downloads += 1
             
-            # Progress update every 10 cards
-            if self.downloaded_cards % 10 == 0:
-                print(f"📥 Downloaded {self.downloaded_cards}/{self.total_cards} cards ({self.downloaded_cards/self.total_cards*100:.1f}%)")
+            with self.stats_lock:
+                self.downloaded_cards += 1
+                
+                # Progress update every 10 cards
+                if self.downloaded_cards % 10 == 0:
+                    print(f"📥 Downloaded {self.downloaded_cards}/{self.total_cards} cards ({self.downloaded_cards/self.total_cards*100:.1f}%)")
             
             return card
             
         except Exception as e:
             print(f"❌ Error processing card {card_id}: {e}")
-            self.failed_cards.append({
-                'card_id': card_id,
-                'error': str(e)
-            })
+            with self.stats_lock:
+                self.failed_cards.append({
+                    'card_id': card_id,
+                    'error': str(e)
+                })
             return None
     
     def download_all_cards(self):
@@ -165,6 +239,8 @@ class PokemonCardDownloader:
         print(f"📊 Total cards to download: {self.total_cards}")
         
         # Second pass: download everything
+        # The thread pool is only needed when aiohttp isn't available
+        executor = ThreadPoolExecutor(max_workers=self.max_workers) if aiohttp is None else None
         for i, set_data in enumerate(sets, 1):
             set_id = set_data.get('id')
             set_name = set_data.get('name', 'Unknown Set')
@@ -186,9 +262,15 @@ class PokemonCardDownloader:
                 if not cards:
                     break
                 
-                # Process each card
-                for card in cards:
-                    processed_card = self.process_card(card)
+                # Process the page's cards concurrently, on one event loop when aiohttp is
+                # available and on the thread pool otherwise; both keep the API's card order
+                if aiohttp is not None:
+                    asyncio.run(self._download_page(cards))
+                    processed_cards = [self.process_card(card, prefetched=True) for card in cards]
+                else:
+                    processed_cards = executor.map(self.process_card, cards)
+                
+                for processed_card in processed_cards:
                     if processed_card:
                         cards_in_set.append(processed_card)
                         all_cards.append(processed_card)
@@ -202,27 +284,31 @@ class PokemonCardDownloader:
             
             # Save set data
             set_filename = self.data_dir / f"set_{set_id}.json"
-            with open(set_filename, 'w') as f:
-                json.dump({
-                    'set_info': set_data,
-                    'cards': cards_in_set,
-                    'total_cards': len(cards_in_set)
-                }, f, indent=2)
+            write_json(set_filename, {
+                'set_info': set_data,
+                'cards': cards_in_set,
+                'total_cards': len(cards_in_set)
+            })
             
             print(f"✅ Completed set {set_name}: {len(cards_in_set)} cards")
         
+        if executor is not None:
+            executor.shutdown()
+        
         # Save all cards data
         print("\n💾 Saving complete card database...")
-        with open(self.data_dir / "all_cards.json", 'w') as f:
-            json.dump(all_cards, f, indent=2)
+        # Machine-read and tens of MB, so written compact
+        write_json(self.data_dir / "all_cards.json", all_cards, indent=False)
+        
+        # Map local image filenames back to card ids for the embeddings generator
+        self.save_image_index(all_cards)
         
         # Create CSV for easy analysis
         self.create_csv_export(all_cards)
         
         # Save failed downloads log
         if self.failed_cards:
-            with open(self.data_dir / "failed_downloads.json", 'w') as f:
-                json.dump(self.failed_cards, f, indent=2)
+            write_json(self.data_dir / "failed_downloads.json", self.failed_cards)
         
         # Final statistics
         end_time = datetime.now()
@@ -290,20 +376,33 @@ class PokemonCardDownloader:
                     all_cards.extend(data['cards'])
         return all_cards
 
+    def save_image_index(self, cards):
+        """Save index.json mapping each local image filename to its card id."""
+        image_index = {}
+        for card in cards:
+            for size in ('large', 'small'):
+                if card.get('images', {}).get(size):
+                    image_index[safe_local_name(card, size)] = card.get('id', 'unknown')
+        
+        write_json(self.data_dir / "index.json", image_index, indent=False)
+        
+        print(f"✅ Image index saved with {len(image_index)} files")
+
     def create_unified_card_database(self):
         """Create a single JSON file containing all cards."""
-        logger.info("Creating unified card database...")
+        print("Creating unified card database...")
         all_cards = self.get_all_card_data()
         
         if not all_cards:
-            logger.error("No card data found to unify.")
+            print("❌ No card data found to unify.")
             return
 
         output_path = self.data_dir / "all_cards.json"
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(all_cards, f, indent=2)
+        write_json(output_path, all_cards, indent=False)
+        
+        self.save_image_index(all_cards)
             
-        logger.info(f"✅ Unified database created with {len(all_cards)} cards at: {output_path}")
+        print(f"✅ Unified database created with {len(all_cards)} cards at: {output_path}")
 
     def run(self, download_images=True):
         """Run the downloader"""
@@ -313,15 +412,16 @@ class PokemonCardDownloader:
 
 def main():
     """Main function"""
-    # Initialize downloader
-    downloader = PokemonCardDownloader()
-
     # Setup argument parser
     parser = argparse.ArgumentParser(description="Pokémon TCG Data Downloader")
     parser.add_argument("--skip-images", action="store_true", help="Skip downloading card images")
     parser.add_argument("--create-db-only", action="store_true", help="Only create the unified database from existing files")
+    parser.add_argument("--workers", type=int, default=16, help="Number of concurrent image downloads (threads, or in-flight aiohttp requests)")
     args = parser.parse_args()
 
+    # Initialize downloader
+    downloader = PokemonCardDownloader(max_workers=args.workers, max_concurrent_requests=args.workers)
+
     # Start process
     try:
         if args.create_db_only:
@@ -42,7 +42,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
         canvas.toBlob(async (blob) => {
             const formData = new FormData();
-            formData.append('card_image', blob, 'scan.png');
+            formData.append('card_image', blob, 'scan.jpg');
 
             try {
                 // Use the same hostname as the page, but on port 5001 (the backend)
@@ -69,7 +69,7 @@ document.addEventListener('DOMContentLoaded', () => {
             } finally {
                 loadingIndicator.classList.add('hidden');
             }
-        }, 'image/png');
+        }, 'image/jpeg', 0.92); // JPEG: much smaller upload than PNG, decoded server-side by libjpeg-turbo
     });
     
     function displayResult(result) {
@@ -6,7 +6,15 @@ from PIL import Image
 import io
 import numpy as np
 import re
-from scipy.spatial.distance import cdist
+import bisect
+import json
+import hashlib
+import threading
+import time
+import queue
+from concurrent.futures import Future, ThreadPoolExecutor
+from collections import OrderedDict, defaultdict
+from pathlib import Path
 
 # Important: We need to be able to import from the embeddings script
 from pokemon_clip_embeddings import PokemonCLIPProcessor
@@ -18,6 +26,23 @@ except ImportError:
     print("EasyOCR not found. Please run 'pip install easyocr'")
     easyocr = None
 
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB
+    turbo_jpeg = TurboJPEG()
+except (ImportError, OSError, RuntimeError):
+    # Module missing, or it couldn't find the libjpeg-turbo shared library
+    turbo_jpeg = None
+
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -33,24 +58,24 @@ try:
     # Initialize the CLIP processor
     clip_processor = PokemonCLIPProcessor(model_name="ViT-B/32")
     
-    # Load the search index
+    # Load the search index. The embeddings are memory-mapped read-only: they are
+    # already normalized float16 rows on disk, so workers share the same pages
+    # through the OS cache and the tie-break upcasts only the candidate rows.
     image_type = "large"
-    model_name_slug = clip_processor.model_name
-    index_file = clip_processor.embeddings_dir / f"search_index_{image_type}_{model_name_slug}.pkl"
-    
-    if index_file.exists():
-        logger.info(f"🔍 Loading search index from: {index_file}")
-        import pickle
-        with open(index_file, 'rb') as f:
-            search_index = pickle.load(f)
+    search_index = clip_processor.load_search_index(image_type)
+    
+    if search_index is not None:
+        logger.info(f"🔍 Loaded search index from: {search_index['index_file']}")
         logger.info("✅ Search index loaded successfully.")
     else:
         logger.error("🚨 Search index not found! Please run the embedding script first.")
-        search_index = None
 
     # --- Initialize OCR Reader ---
     if easyocr:
         logger.info("🔍 Initializing OCR Reader...")
+        # The defaults already use CUDA when present and int8-quantize the models on CPU.
+        # cudnn_benchmark is left off: it is process-wide (CLIP too) and re-tunes for every
+        # new input shape, and OCR inputs vary with aspect ratio and text line width.
         ocr_reader = easyocr.Reader(['en'])
         logger.info("✅ OCR Reader initialized.")
     else:
@@ -63,11 +88,457 @@ except Exception as e:
     ocr_reader = None
 
 # --- Helper Functions ---
+class LRUCache:
+    """A small thread-safe LRU mapping, shared by the per-image caches."""
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+# OCR output keyed by a hash of the uploaded bytes, so retries and duplicate uploads
+# skip the detector/recognizer nets. Set OCR_CACHE_DIR to also keep results on disk.
+ocr_cache = LRUCache(maxsize=512)
+OCR_CACHE_DIR = Path(os.environ['OCR_CACHE_DIR']) if os.environ.get('OCR_CACHE_DIR') else None
+
+# Final matches keyed the same way; a repeated upload is answered without OCR or CLIP
+result_cache = LRUCache(maxsize=4096)
+
+# EasyOCR's detector cost grows with pixel count; card text stays legible well below
+# phone-camera resolution, so OCR runs on a copy bounded to this many pixels per side.
+OCR_MAX_SIDE = 1024
+
+def decode_upload(image_bytes):
+    """Decode an uploaded image to an array, using libjpeg-turbo for JPEGs when available."""
+    if turbo_jpeg is not None and image_bytes[:2] == b'\xff\xd8':
+        try:
+            return turbo_jpeg.decode(image_bytes, pixel_format=TJPF_RGB)
+        except OSError:
+            # Let PIL have a go (and report the error) if turbojpeg rejects it
+            pass
+    return np.array(Image.open(io.BytesIO(image_bytes)))
+
+def downscale_for_ocr(img_np):
+    """Return img_np shrunk so its longer side is at most OCR_MAX_SIDE."""
+    h, w = img_np.shape[:2]
+    scale = OCR_MAX_SIDE / max(h, w)
+    if scale >= 1:
+        return img_np
+    size = (max(1, round(w * scale)), max(1, round(h * scale)))
+    return np.asarray(Image.fromarray(img_np).resize(size, Image.BOX))
+
+# EasyOCR arguments shared by the single-image and batched calls
+OCR_KWARGS = {'detail': 0, 'paragraph': False, 'canvas_size': OCR_MAX_SIDE, 'mag_ratio': 1.0}
+
+class OCRBatcher:
+    """
+    Coalesce concurrent OCR requests into batched EasyOCR calls on one worker thread.
+    
+    Jobs arriving within wait_ms of the first queued one (up to max_batch) are run
+    together; EasyOCR can only stack same-sized images, so each batch is grouped by
+    shape and singletons fall back to readtext. The worker is started lazily so every
+    forked gunicorn worker gets its own thread and queue.
+    """
+    def __init__(self, reader, max_batch=8, wait_ms=10):
+        self.reader = reader
+        self.max_batch = max_batch
+        self.wait = wait_ms / 1000
+        self._lock = threading.Lock()
+        self._queue = None
+        self._pid = None
+
+    def submit(self, img_np):
+        """Queue an image for OCR and return a Future resolving to its text fragments."""
+        future = Future()
+        self._ensure_worker().put((img_np, future))
+        return future
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, args=(self._queue,), name="ocr-batcher", daemon=True).start()
+            return self._queue
+
+    def _run(self, jobs_queue):
+        while True:
+            jobs = [jobs_queue.get()]
+            deadline = time.monotonic() + self.wait
+            while len(jobs) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    jobs.append(jobs_queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._process(jobs)
+
+    def _process(self, jobs):
+        groups = {}
+        for img_np, future in jobs:
+            if future.set_running_or_notify_cancel():
+                groups.setdefault(img_np.shape, []).append((img_np, future))
+
+        for group in groups.values():
+            images = [img_np for img_np, _ in group]
+            try:
+                if len(images) == 1:
+                    results = [self.reader.readtext(images[0], **OCR_KWARGS)]
+                else:
+                    results = self.reader.readtext_batched(images, batch_size=len(images), **OCR_KWARGS)
+            except Exception as e:
+                for _, future in group:
+                    future.set_exception(e)
+                continue
+            for (_, future), ocr_results in zip(group, results):
+                future.set_result(ocr_results)
+
+def cached_card_text(image_key):
+    """Return the cached OCR results for an upload (memory, then disk), or None."""
+    ocr_results = ocr_cache.get(image_key)
+    if ocr_results is not None or OCR_CACHE_DIR is None:
+        return ocr_results
+
+    cache_file = OCR_CACHE_DIR / f"{image_key}.json"
+    if cache_file.exists():
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                ocr_results = json.load(f)
+        except (OSError, ValueError):
+            return None
+        ocr_cache.put(image_key, ocr_results)
+    return ocr_results
+
+def read_card_text(image_key, img_np):
+    """Run OCR on an image, reusing the cached result for identical uploads."""
+    ocr_results = cached_card_text(image_key)
+    if ocr_results is not None:
+        return ocr_results
+
+    # The full-resolution img_np is left untouched for the CLIP tie-break
+    ocr_results = ocr_batcher.submit(downscale_for_ocr(img_np)).result()
+    if OCR_CACHE_DIR is not None:
+        cache_file = OCR_CACHE_DIR / f"{image_key}.json"
+        try:
+            OCR_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            tmp_file = cache_file.with_suffix(f'.{os.getpid()}.tmp')
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(ocr_results, f)
+            os.replace(tmp_file, cache_file)
+        except OSError:
+            logger.warning(f"Could not write OCR cache file: {cache_file}")
+
+    ocr_cache.put(image_key, ocr_results)
+    return ocr_results
+
+# ASCII bytes that clean_text drops; anything non-ASCII is dropped by the encode
+_NON_ALNUM_BYTES = bytes(b for b in range(128) if not chr(b).isalnum())
+_CARD_NUM_RE = re.compile(r'(\d+)\s*/\s*(\d+)')
+
 def clean_text(text):
-    return re.sub(r'[^a-zA-Z0-9]', '', text).lower()
+    """Keep only ASCII letters and digits, lowercased (same as re.sub('[^a-zA-Z0-9]', ''))."""
+    return text.encode('ascii', 'ignore').translate(None, _NON_ALNUM_BYTES).decode('ascii').lower()
+
+def build_automaton(words):
+    """Build an Aho-Corasick automaton mapping each non-empty word to its position in words."""
+    if ahocorasick is None or not any(words):
+        return None
+    automaton = ahocorasick.Automaton()
+    for word_id, word in enumerate(words):
+        if word:
+            automaton.add_word(word, word_id)
+    automaton.make_automaton()
+    return automaton
+
+def build_scoring_index(search_index, processor):
+    """
+    Precompute everything the scoring loop needs from the card database, once at startup.
+    
+    Returns a dict with:
+        records: one entry per card in processor.all_cards with cleaned name/attack
+            names and the number/printed-total strings used for number matching
+        metadata_to_record_idx: for each row of search_index['metadata'], the index
+            of its record (None if the card is missing from the database)
+    
+    plus NumPy arrays aligned with the search index rows, used by score_cards:
+        valid: row has a card record
+        number_pairs: (number, printedTotal) strings -> list of valid rows with that pair
+        number_match_dominates: a number match alone beats any row's best possible
+            name + attack score, so only number-matched rows can take the top score
+        name_ids: index into names (unique cleaned card names), -1 for invalid rows
+        attack_offsets / attack_ids: CSR layout of each row's attacks, as indices
+            into attack_names (unique cleaned attack names)
+    
+    and, when pyahocorasick is installed, automatons over names and attack_names plus
+    names_blob/name_starts (all names joined into one string) for multi-pattern matching.
+    """
+    records = [
+        {
+            'card_id': card['id'],
+            'name': card.get('name', ''),
+            'clean_name': clean_text(card.get('name', '')),
+            'number': str(card.get('number')),
+            'printed_total': str(card.get('set', {}).get('printedTotal')),
+            'clean_attacks': tuple(clean_text(a.get('name', '')) for a in card.get('attacks', []))
+        }
+        for card in processor.all_cards
+    ]
+    card_id_to_index = {card['id']: i for i, card in enumerate(processor.all_cards)}
+    metadata_to_record_idx = [card_id_to_index.get(meta['card_id']) for meta in search_index['metadata']]
+    
+    # Row-aligned arrays for vectorized scoring
+    name_vocab = {}
+    attack_vocab = {}
+    numbers, printed_totals, name_ids = [], [], []
+    attack_offsets, attack_ids = [0], []
+    for record_idx in metadata_to_record_idx:
+        if record_idx is None:
+            numbers.append('')
+            printed_totals.append('')
+            name_ids.append(-1)
+        else:
+            record = records[record_idx]
+            numbers.append(record['number'])
+            printed_totals.append(record['printed_total'])
+            name_ids.append(name_vocab.setdefault(record['clean_name'], len(name_vocab)))
+            for attack_name in record['clean_attacks']:
+                attack_ids.append(attack_vocab.setdefault(attack_name, len(attack_vocab)))
+        attack_offsets.append(len(attack_ids))
+    
+    names = list(name_vocab)
+    attack_names = list(attack_vocab)
+    
+    max_attacks = max((attack_offsets[i + 1] - attack_offsets[i] for i in range(len(attack_offsets) - 1)), default=0)
+    
+    number_pairs = defaultdict(list)
+    for row, record_idx in enumerate(metadata_to_record_idx):
+        if record_idx is not None:
+            number_pairs[(numbers[row], printed_totals[row])].append(row)
+    
+    # Joined with a separator that clean_text never produces, so no match spans two names
+    names_blob = "\n".join(names)
+    name_starts = []
+    position = 0
+    for name in names:
+        name_starts.append(position)
+        position += len(name) + 1
+    
+    return {
+        'records': records,
+        'metadata_to_record_idx': metadata_to_record_idx,
+        'valid': np.array([idx is not None for idx in metadata_to_record_idx], dtype=bool),
+        'number_pairs': dict(number_pairs),
+        'number_match_dominates': NUMBER_SCORE > NAME_SCORE + ATTACK_SCORE * max_attacks,
+        'name_ids': np.array(name_ids, dtype=np.int64),
+        'names': names,
+        'names_blob': names_blob,
+        'name_starts': name_starts,
+        'name_automaton': build_automaton(names),
+        'attack_offsets': np.array(attack_offsets, dtype=np.int64),
+        'attack_ids': np.array(attack_ids, dtype=np.int64),
+        'attack_names': attack_names,
+        'attack_automaton': build_automaton(attack_names)
+    }
+
+def match_names(long_texts, name_ids=None):
+    """
+    Return a bool array over scoring_index['names']: True where the name contains one of
+    the OCR fragments or is contained in one.
+    
+    If name_ids is given, only those names are tested (directly, which is cheaper than an
+    automaton pass over the whole catalog for a handful of names); the rest stay False.
+    """
+    names = scoring_index['names']
+    matched = np.zeros(len(names), dtype=bool)
+    if not long_texts:
+        return matched
+    if name_ids is not None or scoring_index['name_automaton'] is None:
+        for name_id in (range(len(names)) if name_ids is None else name_ids):
+            name = names[name_id]
+            matched[name_id] = any(text in name or name in text for text in long_texts)
+        return matched
+    
+    # Card names contained in a fragment: one automaton pass per fragment
+    for text in long_texts:
+        for _, name_id in scoring_index['name_automaton'].iter(text):
+            matched[name_id] = True
+    
+    # Fragments contained in a card name: one pass of a per-request automaton over all names
+    fragments = ahocorasick.Automaton()
+    for text in long_texts:
+        fragments.add_word(text, text)
+    fragments.make_automaton()
+    for end_idx, _ in fragments.iter(scoring_index['names_blob']):
+        matched[bisect.bisect_right(scoring_index['name_starts'], end_idx) - 1] = True
+    
+    # An empty name is contained in every fragment but can't be added to an automaton
+    if '' in names:
+        matched[names.index('')] = True
+    
+    return matched
+
+def match_attacks(detected_texts, attack_ids=None):
+    """
+    Return an int array over scoring_index['attack_names']: 1 where the attack name appears
+    in an OCR fragment. If attack_ids is given, only those attacks are tested; the rest stay 0.
+    """
+    attack_names = scoring_index['attack_names']
+    matched = np.zeros(len(attack_names), dtype=np.int64)
+    if attack_ids is not None or scoring_index['attack_automaton'] is None:
+        for attack_id in (range(len(attack_names)) if attack_ids is None else attack_ids):
+            attack = attack_names[attack_id]
+            matched[attack_id] = bool(attack) and any(attack in text for text in detected_texts)
+        return matched
+    
+    for text in detected_texts:
+        for _, attack_id in scoring_index['attack_automaton'].iter(text):
+            matched[attack_id] = 1
+    return matched
+
+# Points per check; the numba kernel and the NumPy fallback both read these
+NUMBER_SCORE = 100
+NAME_SCORE = 20
+ATTACK_SCORE = 10
+
+if njit is not None:
+    # Single-threaded on purpose: a per-row add over the catalog gains nothing from
+    # prange, and numba's omp/workqueue thread pools break under fork and gthread workers
+    @njit(cache=True)
+    def _score_kernel(number_hit, name_ids, name_matched, attack_starts, attack_ends, attack_ids, attack_matched, valid):
+        """Per-row reduction of the match flags into scores."""
+        scores = np.zeros(len(name_ids), dtype=np.int64)
+        for i in range(len(name_ids)):
+            if not valid[i]:
+                continue
+            score = 0
+            if number_hit[i]:
+                score += NUMBER_SCORE
+            if name_ids[i] >= 0 and name_matched[name_ids[i]]:
+                score += NAME_SCORE
+            for j in range(attack_starts[i], attack_ends[i]):
+                score += ATTACK_SCORE * attack_matched[attack_ids[j]]
+            scores[i] = score
+        return scores
+else:
+    _score_kernel = None
+
+def score_cards(detected_texts, card_number_matches, rows=None):
+    """
+    Score rows of the search index against the OCR results in one vectorized pass.
+    
+    Number match (number + printed set total) is worth NUMBER_SCORE, a name match
+    NAME_SCORE, and each matching attack name ATTACK_SCORE. Scores every row, or just
+    the given rows; returns an int array aligned with them. Text matching runs once per
+    unique name/attack (only those of the given rows when rows is passed); the per-row
+    sum uses the numba kernel when numba is installed and NumPy otherwise.
+    """
+    number_rows = find_number_rows(card_number_matches)
+    for i in number_rows:
+        logger.info(f"💥 Number Match! +{NUMBER_SCORE} for {search_index['metadata'][i]['name']}")
+    long_texts = [text for text in detected_texts if len(text) >= 4]
+    offsets = scoring_index['attack_offsets']
+    
+    if rows is None:
+        # Check 1: Card Number Match (Highest Priority)
+        number_hit = np.zeros(len(scoring_index['valid']), dtype=bool)
+        number_hit[np.array(number_rows, dtype=np.int64)] = True
+        
+        # Check 2: Name Match, tested once per unique name rather than once per card
+        name_ids = scoring_index['name_ids']
+        name_matched = match_names(long_texts)
+        
+        # Check 3: Attack Name Match, tested once per unique attack name
+        attack_ids = scoring_index['attack_ids']
+        attack_starts, attack_ends = offsets[:-1], offsets[1:]
+        attack_matched = match_attacks(detected_texts)
+        valid = scoring_index['valid']
+    else:
+        # Same checks, but only the names and attacks of these rows are matched, and the
+        # rows' attack slices are gathered into a small CSR of their own
+        rows = np.asarray(rows, dtype=np.int64)
+        number_hit = np.isin(rows, np.array(number_rows, dtype=np.int64))
+        
+        name_ids = scoring_index['name_ids'][rows]
+        name_matched = match_names(long_texts, np.unique(name_ids[name_ids >= 0]))
+        
+        lengths = offsets[1:][rows] - offsets[:-1][rows]
+        attack_ids = np.concatenate(
+            [np.zeros(0, dtype=np.int64)]
+            + [scoring_index['attack_ids'][offsets[row]:offsets[row + 1]] for row in rows]
+        )
+        attack_ends = np.cumsum(lengths)
+        attack_starts = attack_ends - lengths
+        attack_matched = match_attacks(detected_texts, np.unique(attack_ids))
+        valid = scoring_index['valid'][rows]
+    
+    if _score_kernel is not None:
+        return _score_kernel(
+            number_hit, name_ids, name_matched, attack_starts, attack_ends,
+            attack_ids, attack_matched, valid
+        )
+    
+    scores = np.zeros(len(name_ids), dtype=np.int64)
+    scores[number_hit] += NUMBER_SCORE
+    if len(name_matched):
+        scores[(name_ids >= 0) & name_matched[np.maximum(name_ids, 0)]] += NAME_SCORE
+    
+    # Attack hits summed per row over its CSR slice
+    if len(attack_matched):
+        hits = np.concatenate(([0], np.cumsum(attack_matched[attack_ids])))
+        scores += ATTACK_SCORE * (hits[attack_ends] - hits[attack_starts])
+    
+    scores[~valid] = 0
+    return scores
+
+def find_number_rows(card_number_matches):
+    """Return the sorted index rows whose (number, printedTotal) pair was read by OCR."""
+    number_pairs = scoring_index['number_pairs']
+    return sorted({row for pair in card_number_matches for row in number_pairs.get(pair, ())})
 
 def get_full_card_details(card_id, processor):
-    return next((card for card in processor.all_cards if card['id'] == card_id), None)
+    return processor.card_by_id.get(card_id)
+
+# --- Scoring Index ---
+scoring_index = None
+if clip_processor and search_index:
+    logger.info("🧮 Precomputing scoring records...")
+    scoring_index = build_scoring_index(search_index, clip_processor)
+    logger.info(f"✅ Scoring records ready for {len(scoring_index['records'])} cards.")
+    if _score_kernel is not None:
+        # Compile (or load from cache) the numba kernel now rather than on the first scan
+        score_cards([], [])
+
+ocr_batcher = OCRBatcher(ocr_reader) if ocr_reader else None
+
+# On CUDA the tie-break embedding is started speculatively alongside OCR. On CPU the
+# two would compete for the same cores and slow down the common, tie-free path, so
+# ties embed inline instead. Speculation is also skipped once every slot is busy.
+SPECULATIVE_EMBEDDINGS = 2
+embedding_executor = ThreadPoolExecutor(max_workers=SPECULATIVE_EMBEDDINGS, thread_name_prefix="clip-embed")
+embedding_slots = threading.BoundedSemaphore(SPECULATIVE_EMBEDDINGS)
+
+def start_speculative_embedding(img_np):
+    """Submit a CLIP embedding of img_np if CLIP runs on CUDA and a slot is free; returns a Future or None."""
+    if clip_processor.device != "cuda" or not embedding_slots.acquire(blocking=False):
+        return None
+    future = embedding_executor.submit(clip_processor.get_single_image_embedding_from_pil, Image.fromarray(img_np))
+    future.add_done_callback(lambda _: embedding_slots.release())
+    return future
 
 # --- API Endpoints ---
 @app.route('/api/scan', methods=['POST'])
@@ -75,19 +546,30 @@ def scan_card():
     if 'card_image' not in request.files:
         return jsonify({'error': 'No image file provided'}), 400
     
-    if not all([clip_processor, search_index, ocr_reader]):
+    if not all([clip_processor, search_index, scoring_index, ocr_batcher]):
         return jsonify({'error': 'Server not initialized properly. Check logs.'}), 500
 
     file = request.files['card_image']
+    embedding_future = None
     
     try:
         image_bytes = file.read()
-        img_np = np.array(Image.open(io.BytesIO(image_bytes)))
+        image_key = hashlib.blake2b(image_bytes).hexdigest()
+        cached_match = result_cache.get(image_key)
+        if cached_match is not None:
+            logger.info(f"♻️ Returning cached match: {cached_match['metadata']['name']}")
+            return jsonify(cached_match)
+        
+        img_np = decode_upload(image_bytes)
         
         logger.info("📸 Received image, beginning scan with new 'Multi-Factor Scoring' logic...")
 
         # --- Stage 1: OCR Text Recognition ---
-        ocr_results = ocr_reader.readtext(img_np, detail=0, paragraph=False)
+        ocr_results = cached_card_text(image_key)
+        if ocr_results is None:
+            # OCR has to run, so overlap it with the embedding a tie would need
+            embedding_future = start_speculative_embedding(img_np)
+            ocr_results = read_card_text(image_key, img_np)
         # Clean and get unique texts, prioritizing longer ones
         detected_texts = sorted(list(set([clean_text(t) for t in ocr_results])), key=len, reverse=True)
         raw_ocr_text = " ".join(ocr_results)
@@ -95,75 +577,55 @@ def scan_card():
 
         # --- Stage 2: Extract Key Information from OCR ---
         # Find card numbers like "049/182" or "49/182"
-        card_number_matches = re.findall(r'(\d+)\s*/\s*(\d+)', raw_ocr_text)
+        card_number_matches = _CARD_NUM_RE.findall(raw_ocr_text)
         logger.info(f"🔢 Found potential card numbers: {card_number_matches}")
 
-        # --- Stage 3: Score all cards in the index ---
-        card_scores = []
-        for i, indexed_meta in enumerate(search_index['metadata']):
-            score = 0
-            full_card_details = get_full_card_details(indexed_meta['card_id'], clip_processor)
-            if not full_card_details:
-                continue
-
-            # Check 1: Card Number Match (Highest Priority)
-            if card_number_matches:
-                card_num = full_card_details.get('number')
-                set_total = full_card_details.get('set', {}).get('printedTotal')
-                for ocr_num, ocr_total in card_number_matches:
-                    if str(card_num) == str(ocr_num) and str(set_total) == str(ocr_total):
-                        score += 100
-                        logger.info(f"💥 Number Match! +100 for {full_card_details['name']}")
-                        break
-            
-            # Check 2: Name Match
-            card_name_clean = clean_text(full_card_details.get('name', ''))
-            for text in detected_texts:
-                if len(text) >= 4 and (text in card_name_clean or card_name_clean in text):
-                    score += 20
-                    break # Only score name once
-
-            # Check 3: Attack Name Match
-            if 'attacks' in full_card_details:
-                for attack in full_card_details['attacks']:
-                    attack_name_clean = clean_text(attack.get('name', ''))
-                    if attack_name_clean and any(attack_name_clean in t for t in detected_texts):
-                        score += 10
-            
-            if score > 0:
-                card_scores.append({'score': score, 'index': i, 'meta': indexed_meta})
+        # --- Stage 3: Score the cards in the index ---
+        # When a number match outweighs every other check combined, only the rows it
+        # hits can win, so the rest of the index doesn't need scoring
+        number_rows = find_number_rows(card_number_matches)
+        if number_rows and scoring_index['number_match_dominates']:
+            scored_rows = np.array(number_rows, dtype=np.int64)
+            row_scores = score_cards(detected_texts, card_number_matches, scored_rows)
+        else:
+            scores = score_cards(detected_texts, card_number_matches)
+            scored_rows = np.flatnonzero(scores > 0)
+            row_scores = scores[scored_rows]
         
-        if not card_scores:
+        if not len(scored_rows):
             logger.warning("No cards scored > 0. Falling back to pure image search.")
             # Fallback logic here if needed, or just return no match
             return jsonify({'error': 'Could not find a matching card.'}), 404
 
         # --- Stage 4: Determine the best match ---
-        card_scores.sort(key=lambda x: x['score'], reverse=True)
-        logger.info(f"🏆 Top 3 candidates: " + ", ".join([f"{c['meta']['name']} ({c['score']})" for c in card_scores[:3]]))
+        # Candidates stay as row/score arrays; a stable sort keeps index order among equal scores
+        order = np.argsort(-row_scores, kind='stable')
+        metadata = search_index['metadata']
+        logger.info(f"🏆 Top 3 candidates: " + ", ".join([f"{metadata[scored_rows[i]]['name']} ({row_scores[i]})" for i in order[:3]]))
         
-        top_score = card_scores[0]['score']
-        best_candidates = [c for c in card_scores if c['score'] == top_score]
+        top_score = int(row_scores[order[0]])
+        best_rows = scored_rows[row_scores == top_score]
         
         final_match_card = None
         match_method = "Scoring"
 
-        if len(best_candidates) == 1:
+        if len(best_rows) == 1:
             logger.info("Single best card found by score.")
-            final_match_card = get_full_card_details(best_candidates[0]['meta']['card_id'], clip_processor)
+            final_match_card = get_full_card_details(metadata[best_rows[0]]['card_id'], clip_processor)
         else:
             # Tie-breaker using image similarity
-            logger.info(f"Score tie between {len(best_candidates)} cards. Using image similarity to break tie.")
-            temp_image_path = "temp_query_card.png"
-            Image.fromarray(img_np).save(temp_image_path)
-            query_embedding = clip_processor.get_single_image_embedding(temp_image_path)
-            os.remove(temp_image_path)
+            logger.info(f"Score tie between {len(best_rows)} cards. Using image similarity to break tie.")
+            if embedding_future is not None:
+                query_embedding = embedding_future.result()
+            else:
+                query_embedding = clip_processor.get_single_image_embedding_from_pil(Image.fromarray(img_np))
 
             if query_embedding is not None:
-                tiebreaker_embeddings = np.array([search_index['embeddings'][c['index']] for c in best_candidates])
-                similarities = 1 - cdist(query_embedding.reshape(1, -1), tiebreaker_embeddings, 'cosine')
-                best_match_index = np.argmax(similarities)
-                final_match_card = get_full_card_details(best_candidates[best_match_index]['meta']['card_id'], clip_processor)
+                # One gather of the tied rows from the contiguous matrix, then a single gemv
+                query_unit = query_embedding.astype(np.float32) / np.linalg.norm(query_embedding)
+                similarities = search_index['embeddings'][best_rows].astype(np.float32) @ query_unit
+                best_row = best_rows[int(np.argmax(similarities))]
+                final_match_card = get_full_card_details(metadata[best_row]['card_id'], clip_processor)
                 match_method = "Scoring with Image Tie-break"
 
         if final_match_card:
@@ -174,6 +636,7 @@ def scan_card():
                 'match_method': match_method
             }
             logger.info(f"✅ Final match ({match_method}): {final_match['metadata']['name']}")
+            result_cache.put(image_key, final_match)
             return jsonify(final_match)
         else:
             logger.error("❌ Could not find a matching card in the end.")
@@ -182,6 +645,10 @@ def scan_card():
     except Exception as e:
         logger.exception("💥 Error during card scanning process.")
         return jsonify({'error': f'An internal error occurred: {e}'}), 500
+    finally:
+        # No tie (or an early exit): drop the speculative embedding if it hasn't started
+        if embedding_future is not None:
+            embedding_future.cancel()
 
 @app.route('/')
 def index():
@@ -194,6 +661,7 @@ if __name__ == '__main__':
     if os.path.exists(cert_path) and os.path.exists(key_path):
         ssl_context = (cert_path, key_path)
         logger.info("✅ Starting Flask backend server with HTTPS...")
-        app.run(host='0.0.0.0', port=5001, debug=True, ssl_context=ssl_context)
+        # Development only; use `gunicorn -c gunicorn_conf.py scanner_app:app` to serve
+        app.run(host='0.0.0.0', port=5001, ssl_context=ssl_context)
     else:
         logger.error("\n❌ ERROR: Could not find cert.pem or key.pem.") 
\ No newline at end of file